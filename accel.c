@@ -61,9 +61,12 @@ static struct sprite *find_sprite(uint32_t *needle, struct sprite *haystack, int
     return NULL;
 }
 
-int identify_sprites(uint8_t *image, struct sprite *sprites, int n_sprites, struct sprite_match *matched, int max_matches) {
+int identify_sprites_reference(uint8_t *image, struct sprite *sprites, int n_sprites, struct sprite_match *matched, int max_matches) {
     /*
     Identify sprites using palette pattern matching
+
+    Straightforward version that re-reads the whole 7x14 window at every
+    position. Kept to check and benchmark identify_sprites against.
     */
     int x, y;
 
@@ -161,6 +164,168 @@ int identify_sprites(uint8_t *image, struct sprite *sprites, int n_sprites, stru
     return match_count;
 }
 
+/* a sprite column is packed as 14 2-bit pixels, top row in the high bits */
+#define COL_MASK 0x0FFFFFFF
+#define COL_LOW_BITS 0x05555555
+
+static const int kPopCount4[16] = {0, 1, 1, 2, 1, 2, 2, 3, 1, 2, 2, 3, 2, 3, 3, 4};
+
+/* low bit of each pixel in a packed column that has the given color */
+static inline uint32_t col_pixels_equal(uint32_t col, int color) {
+    uint32_t diff = col ^ (COL_LOW_BITS * color);
+    return ~(diff | (diff >> 1)) & COL_LOW_BITS;
+}
+
+/* bitmask of the colors present in a packed column */
+static inline int col_colors(uint32_t col) {
+    int color, mask = 0;
+    for (color = 0; color < 4; ++color) {
+        if (col_pixels_equal(col, color)) {
+            mask |= 1 << color;
+        }
+    }
+    return mask;
+}
+
+int identify_sprites(uint8_t *image, struct sprite *sprites, int n_sprites, struct sprite_match *matched, int max_matches) {
+    return identify_sprites_rows(image, 1, 160 - kSpriteY, sprites, n_sprites, matched, max_matches);
+}
+
+int identify_sprites_rows(uint8_t *image, int y_start, int y_end, struct sprite *sprites, int n_sprites, struct sprite_match *matched, int max_matches) {
+    /*
+    Identify sprites using palette pattern matching, for sprites with
+    their top row in [y_start, y_end)
+
+    Finds exactly the same matches as identify_sprites_reference, but
+    neighboring windows share most of their pixels, so instead of
+    re-reading each window:
+    - every column of the current row is kept packed, and slid down
+      one pixel at a time when moving to the next row
+    - the "solid above" test uses run lengths of the row above
+    - palette normalization is done on the packed columns
+
+    Input must already be translated to colors in [0, 3].
+    */
+    uint32_t cols[240];
+    uint8_t col_color_masks[240];
+    uint8_t run_above[240];
+    int x, y, i;
+    int cols_y = -1;
+    int match_count = 0;
+
+    if (y_start < 1) {
+        y_start = 1;
+    }
+    if (y_end > 160 - kSpriteY) {
+        y_end = 160 - kSpriteY;
+    }
+
+    for (y = y_start; y < y_end; ++y) {
+        int found = 0;
+        int lastX = -1;
+
+        // pack the columns starting at this row
+        if (cols_y == y - 1) {
+            for (x = 0; x < 240; ++x) {
+                cols[x] = ((cols[x] << 2) | SP_PIX(x, y + kSpriteY - 1)) & COL_MASK;
+                col_color_masks[x] = col_colors(cols[x]);
+            }
+        } else {
+            for (x = 0; x < 240; ++x) {
+                uint32_t col = 0;
+                for (i = 0; i < kSpriteY; ++i) {
+                    col = (col << 2) | SP_PIX(x, y + i);
+                }
+                cols[x] = col;
+                col_color_masks[x] = col_colors(col);
+            }
+        }
+        cols_y = y;
+
+        // length of the run of identical pixels starting at x on the row above
+        run_above[239] = 1;
+        for (x = 238; x >= 0; --x) {
+            run_above[x] = 1;
+            if (SP_PIX(x, y - 1) == SP_PIX(x + 1, y - 1)) {
+                run_above[x] += run_above[x + 1];
+            }
+            if (run_above[x] > kSpriteX) {
+                run_above[x] = kSpriteX;
+            }
+        }
+
+        for (x = 0; x < 240 - kSpriteX; ++x) {
+            // skip if it's not solid above
+            // (like the reference, this also skips the window where the run ends)
+            if (run_above[x] < kSpriteX) {
+                x += run_above[x];
+                continue;
+            }
+
+            // skip if it's a solid line on the left
+            if (cols[x] == COL_LOW_BITS * (cols[x] >> 26)) {
+                continue;
+            }
+
+            int window_colors = 0;
+            for (i = 0; i < kSpriteX; ++i) {
+                window_colors |= col_color_masks[x + i];
+            }
+            if (kPopCount4[window_colors] != 3) {
+                continue;
+            }
+
+            // palette colors are numbered in order of first appearance,
+            // scanning each column from the top
+            int first = cols[x] >> 26;
+            int second = -1, third;
+            for (i = 0; second < 0; ++i) {
+                uint32_t others = ~col_pixels_equal(cols[x + i], first) & COL_LOW_BITS;
+                if (others) {
+                    second = (cols[x + i] >> (31 - __builtin_clz(others))) & 3;
+                }
+            }
+            for (third = 0; third < 4; ++third) {
+                if (third != first && third != second && (window_colors & (1 << third))) {
+                    break;
+                }
+            }
+
+            uint32_t screen_tile[7];
+            for (i = 0; i < kSpriteX; ++i) {
+                screen_tile[i] = col_pixels_equal(cols[x + i], second) |
+                                 (col_pixels_equal(cols[x + i], third) << 1);
+            }
+
+            struct sprite *sprite = find_sprite(screen_tile, sprites, n_sprites);
+            if (sprite) {
+                matched[match_count].x = x;
+                matched[match_count].y = y;
+                matched[match_count].sp = sprite;
+                matched[match_count].space = 0;
+
+                found = 1;
+
+                if (lastX != -1 && x > lastX + 3) {
+                    matched[match_count].space = 1;
+                }
+
+                if (++match_count >= max_matches) {
+                    return match_count;
+                }
+
+                x += sprite->width - 1;
+                lastX = x;
+            }
+        }
+        if (found) {
+            y += 13;
+        }
+    }
+
+    return match_count;
+}
+
 /* try to combine two different sprite match structures into one, aborting if they have two sprites with the same positions and different ids
    this improves noise tolerance  */
 int merge_sprites(struct sprite_match *a, int a_count, struct sprite_match *b, int b_count, struct sprite_match *dest, int dest_count, int *overlap_out) {
@@ -23,4 +23,8 @@ void translate_bytes(uint8_t *image, int len, uint8_t *table);
 
 int identify_sprites(uint8_t *image, struct sprite *sprites, int n_sprites, struct sprite_match *matched, int max_matches);
 
+int identify_sprites_rows(uint8_t *image, int y_start, int y_end, struct sprite *sprites, int n_sprites, struct sprite_match *matched, int max_matches);
+
+int identify_sprites_reference(uint8_t *image, struct sprite *sprites, int n_sprites, struct sprite_match *matched, int max_matches);
+
 int merge_sprites(struct sprite_match *a, int a_count, struct sprite_match *b, int b_count, struct sprite_match *dest, int dest_count, int *overlap_out);
@@ -1,5 +1,7 @@
+import collections
 import itertools
 import re
+import time
 
 def is_subsequence(a, b):
     b_pos = 0
@@ -41,7 +43,7 @@ def dist_merge(s1, s2):
 class BoxReader(object):
     '''Find each dialog box in the text version of the screen'''
 
-    def __init__(self, max_dist=3):
+    def __init__(self, max_dist=3, incremental=False, stable_frames=3, max_latency=2.0):
         self.last = ''
         self.lastline = ''
         self.group = []
@@ -52,13 +54,137 @@ class BoxReader(object):
         self.last_lines = None
         self.out = open('dialog_raw.txt', 'a')
 
+        # incremental mode: publish each line of a dialog as soon as it
+        # stops changing, instead of waiting for the box to close. Unchanged
+        # frames stop at ScreenExtractor, so stable_frames and max_latency
+        # are only checked when a changed frame arrives: a line on a page
+        # that stays still can go over max_latency until the screen changes.
+        self.incremental = incremental
+        self.event_handlers = []
+        self.stable_frames = stable_frames
+        self.max_latency = max_latency
+        self.seq = 0
+        self.dialog_n = 0
+        self.frame_n = 0
+        self.open_lines = []
+        self.visible_lines = []
+        self.closed_lines = set()
+        self.latencies = collections.deque(maxlen=1000)
+
     def add_dialog_handler(self, handler):
         self.dialog_handlers.append(handler)
 
+    def add_event_handler(self, handler):
+        '''
+        Handlers are called with (event, data) in incremental mode. Events
+        are dicts with 'seq' (increasing for each event), 'dialog', 'type',
+        'line' and 'text'. Types are:
+            line: a line of the current dialog stopped changing
+            correction: a published line changed, replaces its text
+            final: the dialog box closed, 'text' is the merged dialog
+                   (as passed to dialog handlers) and 'lines' its line ids
+        '''
+        self.event_handlers.append(handler)
+
+    def emit_event(self, data, **event):
+        self.seq += 1
+        event['seq'] = self.seq
+        event['dialog'] = self.dialog_n
+        for handler in self.event_handlers:
+            handler(event, data)
+
+    def match_line(self, previous, slot, text):
+        for line in previous:
+            if line['text'] == text:
+                return line  # unchanged, maybe scrolled up
+        for line in previous:
+            if line['slot'] != slot:
+                continue
+            if text.startswith(line['text']):
+                return line  # still being printed
+            if line['text'].startswith(text):
+                continue  # printing started over: the page turned
+            dist, merged = dist_merge(line['text'], text)
+            if dist < self.max_dist:
+                return line  # misread, published lines get a correction
+        return None
+
+    def track_lines(self, data, texts):
+        '''follow the lines of the open dialog box, publishing each one
+        once it's been the same for stable_frames frames, has been on
+        screen for max_latency seconds, or goes away'''
+        seen = data.get('grabbed') or time.time()
+        # unchanged frames never get here, but still count as stable
+        self.frame_n = data.get('frame_n', self.frame_n + 1)
+        previous = self.visible_lines
+        self.visible_lines = []
+        for slot, text in enumerate(texts):
+            text = text.strip()
+            if not text or 'FIGHT BAG' in text or 'POKEMON RUN' in text:
+                continue
+            if text in self.closed_lines:
+                continue  # dialog came back after a screen effect
+            line = self.match_line(previous, slot, text)
+            if line is None:
+                line = {'id': len(self.open_lines), 'text': text, 'changed': self.frame_n,
+                        'first_seen': seen, 'published': None}
+                self.open_lines.append(line)
+            else:
+                previous.remove(line)
+            if line['text'] != text:
+                line['text'] = text
+                line['changed'] = self.frame_n
+            line['slot'] = slot
+            self.visible_lines.append(line)
+
+        for line in previous:
+            self.publish_line(data, line, force=True)  # scrolled away
+        for line in self.visible_lines:
+            self.publish_line(data, line)
+
+    def publish_line(self, data, line, force=False):
+        if line['text'] == line['published']:
+            return
+        stable = self.frame_n - line['changed'] + 1 >= self.stable_frames
+        if line['published'] is None:
+            latency = time.time() - line['first_seen']
+            if not (stable or force or latency >= self.max_latency):
+                return
+            self.latencies.append(latency)
+            self.emit_event(data, type='line', line=line['id'], text=line['text'], latency=latency)
+        elif stable or force:
+            self.emit_event(data, type='correction', line=line['id'], text=line['text'])
+        else:
+            return
+        line['published'] = line['text']
+
+    def finish_lines(self, data, text):
+        for line in self.visible_lines:
+            self.publish_line(data, line, force=True)
+        published = [line for line in self.open_lines if line['published'] is not None]
+        if text or published:
+            self.emit_event(data, type='final', text=text, lines=[line['id'] for line in published])
+            self.closed_lines = set(line['published'] for line in published)
+            self.dialog_n += 1
+        self.open_lines = []
+        self.visible_lines = []
+
+    def latency_stats(self):
+        '''latency in seconds from a line appearing to its publication'''
+        if not self.latencies:
+            return {'count': 0}
+        latencies = sorted(self.latencies)
+        return {'count': len(latencies),
+                'mean': sum(latencies) / len(latencies),
+                'median': latencies[len(latencies) / 2],
+                'max': latencies[-1],
+                'over_bound': sum(1 for l in latencies if l > self.max_latency)}
+
     def handle_dialog(self, data, text):
         #print 'handle_dialog', repr(text), self.continued
 
         if text == '':  # dialog disappeared
+            out = ''
             if self.last:
                 self.group.append(self.last)
             if self.group and self.lastgroup and self.group[0] == self.lastgroup[-1]:
@@ -88,6 +214,8 @@ class BoxReader(object):
                         handler(out, data)
                 self.lastgroup = self.group
                 self.group = []
+            if self.incremental:
+                self.finish_lines(data, out.strip())
             self.last = text
             return
         if text.strip() in ('', self.last.strip()):
@@ -117,6 +245,8 @@ class BoxReader(object):
             self.last_lines = lines
 
         if len(lines) >= 1 and lines[0][0] == 121 and lines[0][1] < 39:
+            if self.incremental:
+                self.track_lines(data, [text for y, xbeg, xend, text in lines])
             self.handle_dialog(data, '\n'.join(text for y, xbeg, xend, text in lines))
         else:
             self.handle_dialog(data, '')
@@ -11,8 +11,10 @@ import Queue
 
 import livestreamer
 import cv2
+import numpy
 
 import delta
+import seek
 import timestamp
 import video
 
@@ -29,17 +31,26 @@ def extract_screen(raw):
 
 class SpriteIdentifier(object):
     '''Convert image sprites into a text format'''
-    def __init__(self, debug=False):
+
+    # screen_to_tiles uses 0-8 for the darkness of unknown tiles
+    TILE_OFFSET = 9
+
+    def __init__(self, debug=False, cache_size=0, tile_sheets=(), full_screen=False):
         self.debug = debug
         if self.debug:
             cv2.namedWindow("Stream", cv2.WINDOW_AUTOSIZE)
             cv2.namedWindow("Game", cv2.WINDOW_AUTOSIZE)
         self.tile_map = self.make_tilemap('emerald_tiles.png')
         self.tile_text = self.make_tile_text('emerald_tiles.txt')
-        self.ocr_engine = video.OCREngine(self.tile_map, self.tile_text)
+        self.ocr_engine = video.OCREngine(self.tile_map, self.tile_text, cache_size=cache_size, full_screen=full_screen)
+        # There's no 8x8 tile sheet for Emerald yet, so tiles are off by
+        # default. The red_tiles*.png sheets are for Pokemon Red (Game Boy)
+        # and barely match anything on Emerald's screen.
+        self.tile_index = self.make_tile_index(tile_sheets) if tile_sheets else None
 
 
-    def make_tile_text(self, fname):
+    @staticmethod
+    def make_tile_text(fname):
         def make_wide(x):
             if not wide or len(x.strip()) < 2:
                 return x[0]
@@ -100,20 +111,55 @@ class SpriteIdentifier(object):
         assert(len(set(buf)) == 3)
         return buf
 
+    def make_tile_index(self, names):
+        '''Index the 8x8 tiles of the given sheets, numbered consecutively
+        across sheets, by their packed bits. Returns sorted (keys, tile numbers)
+        arrays, including inverted variants of each tile.'''
+        index = {}
+        offset = 0
+        for name in names:
+            path = os.path.abspath(os.path.dirname(__file__)) + '/' + name
+            tiles = cv2.cvtColor(cv2.imread(path), cv2.COLOR_BGR2GRAY)
+            keys = self.pack_tiles(self.tile_bits(tiles)).flatten()
+            for n, key in enumerate(keys):
+                index.setdefault(int(key), offset + n)
+            offset += len(keys)
+
+        full = (1 << 64) - 1
+        for key, tile_n in index.items():
+            index.setdefault(~key & full, tile_n)
+        # solid tiles are blank space, not a particular tile
+        index.pop(0, None)
+        index.pop(full, None)
+        if not index:
+            raise ValueError('no tiles found in %s' % ', '.join(names))
+
+        keys = numpy.array(sorted(index), dtype=numpy.uint64)
+        tile_ns = numpy.array([index[key] for key in sorted(index)], dtype=numpy.uint16)
+        return keys, tile_ns
+
+    def tile_bits(self, image):
+        '''Split an image into 8x8 tiles -> (rows, cols, 64) array of dark pixels'''
+        rows, cols = len(image) / 8, len(image[0]) / 8
+        bits = image[:rows*8, :cols*8] < 128
+        return bits.reshape(rows, 8, cols, 8).swapaxes(1, 2).reshape(rows, cols, 64)
+
+    def pack_tiles(self, bits):
+        return numpy.packbits(bits, axis=-1).view('>u8')[..., 0].astype(numpy.uint64)
+
     def screen_to_tiles(self, screen):
-        screen = screen < 128
-        out = []
-        for y in range(18):
-            for x in range(20):
-                sprite = self.sprite_to_int(screen, x, y)
-                tile_n = self.tile_map.get(sprite, 0)
-                if tile_n == 0:
-                    # try inverting it?
-                    tile_n = self.tile_map.get((~sprite)&((1<<64)-1), 0)
-                if tile_n == 0:
-                    tile_n = bin(sprite).count('1') / 8
-                out.append(tile_n)
-        return out
+        '''Classify every 8x8 tile of the screen at once, returning a
+        (rows, cols) array. Tiles that aren't in the index get their
+        darkness (0-8), tiles that are get TILE_OFFSET + their number.'''
+        if self.tile_index is None:
+            raise ValueError('screen_to_tiles needs SpriteIdentifier(tile_sheets=[...])')
+        bits = self.tile_bits(screen)
+        sprites = self.pack_tiles(bits)
+        keys, tile_ns = self.tile_index
+        pos = numpy.searchsorted(keys, sprites).clip(0, len(keys) - 1)
+        found = keys[pos] == sprites
+        shade = bits.sum(axis=-1) / 8
+        return numpy.where(found, tile_ns[pos] + self.TILE_OFFSET, shade).astype(numpy.uint16)
 
     def screen_to_text(self, screen):
         return self.ocr_engine.identify(screen)
@@ -130,6 +176,8 @@ class SpriteIdentifier(object):
 
         text = self.screen_to_text(data['screen'])
         data.update(text=text)
+        if self.tile_index is not None:
+            data.update(tiles=self.screen_to_tiles(data['screen']))
 
     def test_corpus(self, directory='corpus'):
         import os
@@ -146,10 +194,17 @@ class SpriteIdentifier(object):
                 print "%.1f"%((time.time()-start)*1000), text
         print 'TOTAL:', time.time() - sstart
 
+    def bench_corpus(self, directory='corpus', repeat=100):
+        screens = []
+        for fn in sorted(os.listdir(directory)):
+            im = cv2.cvtColor(cv2.imread(directory + '/' + fn), cv2.COLOR_BGR2GRAY)
+            screens.append(extract_screen(im))
+        self.ocr_engine.benchmark(screens, repeat)
+
 
 class StreamProcessor(object):
     '''Grab frames from input and process with handlers'''
-    def __init__(self, bufsize=120, ratelimit=True, frame_skip=0, default_handlers=True, debug=False, video_loc=None):
+    def __init__(self, bufsize=120, ratelimit=True, frame_skip=0, default_handlers=True, debug=False, video_loc=None, full_screen_text=False, start_timestamp_s=None, cache_size=0, tile_sheets=()):
         self.frame_queue = Queue.Queue(bufsize)
         if ratelimit is None:
             # Automatically disable ratelimit if not using the default stream
@@ -159,18 +214,31 @@ class StreamProcessor(object):
         self.frame_skip = frame_skip
         self.handlers = []
         self.video_loc = video_loc
+        # only for recorded videos: start at this play time
+        self.start_timestamp_s = start_timestamp_s
+        self.sprite_identifier = None
         if default_handlers:
+            self.sprite_identifier = SpriteIdentifier(debug=debug, cache_size=cache_size, tile_sheets=tile_sheets,
+                                                      full_screen=full_screen_text)
             self.handlers.append(video.ScreenExtractor().handle)
-            self.handlers.append(SpriteIdentifier(debug=debug).handle)
+            self.handlers.append(self.sprite_identifier.handle)
             self.handlers.append(timestamp.TimestampRecognizer().handle)
 
     def add_handler(self, handler):
         self.handlers.append(handler)
 
     def grab_frames(self):
+        start_pos = None
+        if self.video_loc and self.start_timestamp_s is not None:
+            start_pos = seek.GameTimeSeeker(self.video_loc).seek(self.start_timestamp_s)
+            if start_pos is None:
+                print 'play time %d not found in video' % self.start_timestamp_s
+                self.frame_queue.put(None)
+                return
         while True:
             stream = cv2.VideoCapture(self.get_stream_location())
-            #stream.set(cv2.cv.CV_CAP_PROP_POS_MSEC, (3*60+10)*1000)
+            if start_pos is not None:
+                stream.set(seek.POS_MSEC, start_pos)
             while True:
                 stream.grab()
                 for _ in range(self.frame_skip):
@@ -179,7 +247,7 @@ class StreamProcessor(object):
                 if success:
                     try:
                         frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-                        self.frame_queue.put(frame, block=False, timeout=1.)
+                        self.frame_queue.put((time.time(), frame), block=False, timeout=1.)
                     except Queue.Full:
                         continue
                 else:
@@ -197,10 +265,11 @@ class StreamProcessor(object):
             cur = time.time()
             # give a timeout to avoid python Issue #1360:
             # Ctrl-C doesn't kill threads waiting on queues
-            frame = self.frame_queue.get(True, 60*60*24)
-            if frame is None:
+            item = self.frame_queue.get(True, 60*60*24)
+            if item is None:
                 return
-            data = {'frame': frame}
+            grabbed, frame = item
+            data = {'frame': frame, 'grabbed': grabbed}
             times = []
             tot_elapsed = 0
             for handler in self.handlers:
@@ -261,6 +330,7 @@ class LogHandler(object):
 
 if __name__ == '__main__':
     #SpriteIdentifier().test_corpus();q
+    #SpriteIdentifier().bench_corpus();q
 
 
     def handler_stdout(data):
@@ -290,7 +360,11 @@ if __name__ == '__main__':
         video_loc = sys.argv[sys.argv.index('-f') + 1]
     except (ValueError, IndexError):
         video_loc = None
-    proc = StreamProcessor(debug=debug, video_loc=video_loc)
+    try:
+        start_timestamp_s = int(sys.argv[sys.argv.index('-t') + 1])
+    except (ValueError, IndexError):
+        start_timestamp_s = None
+    proc = StreamProcessor(debug=debug, video_loc=video_loc, start_timestamp_s=start_timestamp_s)
     #proc.add_handler(handler_stdout)
     #proc.add_handler(LogHandler('text', 'frames.log').handle)
     #proc.add_handler(delta.StringDeltaCompressor('dithered', verify=True).handle)
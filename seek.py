@@ -0,0 +1,159 @@
+import json
+import os
+
+import cv2
+
+import timestamp
+
+if hasattr(cv2, 'CAP_PROP_POS_MSEC'):  # OpenCV 3+
+    POS_MSEC, FRAME_COUNT, FPS = cv2.CAP_PROP_POS_MSEC, cv2.CAP_PROP_FRAME_COUNT, cv2.CAP_PROP_FPS
+else:
+    POS_MSEC, FRAME_COUNT, FPS = cv2.cv.CV_CAP_PROP_POS_MSEC, cv2.cv.CV_CAP_PROP_FRAME_COUNT, cv2.cv.CV_CAP_PROP_FPS
+
+MAX_FRAMES = 60 * 60 * 60 * 24 * 30  # a month at 60fps, for videos that don't report their length
+
+
+class GameTimeSeeker(object):
+    '''
+    Find where a play time is in a recorded video, without decoding
+    everything before it: bisect over positions in the video, reading the
+    game clock at each probe.
+
+    Every clock reading is kept in a position index saved next to the
+    video, so later seeks in the same file start from a narrower range.
+    '''
+
+    def __init__(self, fname, index_fname=None, max_retries=8):
+        self.fname = fname
+        self.index_fname = index_fname or fname + '.gametime.json'
+        self.max_retries = max_retries
+        self.recognizer = timestamp.TimestampRecognizer()
+        self.stream = cv2.VideoCapture(fname)
+        self.frame_ms = 1000. / (self.stream.get(FPS) or 30.)
+        self.probes = 0
+        self.unreadable = set()
+        self.seek_late = 0  # frames past the requested one that seeking last landed on
+        self.index = self.load_index()
+
+    def file_id(self):
+        stat = os.stat(self.fname)
+        return [stat.st_size, int(stat.st_mtime)]
+
+    def load_index(self):
+        '''position (ms) -> play time (s) of frames read before'''
+        try:
+            saved = json.load(open(self.index_fname))
+        except (IOError, ValueError):
+            return {}
+        if saved.get('file') != self.file_id():
+            return {}  # the video changed
+        return {pos: timestamp_s for pos, timestamp_s in saved['index']}
+
+    def save_index(self):
+        with open(self.index_fname, 'w') as fd:
+            json.dump({'file': self.file_id(), 'index': sorted(self.index.items())}, fd)
+
+    def probe(self, frame_n, end):
+        '''
+        Read the play time at frame_n, or at the first frame after it
+        (within max_retries frames, and before end) where the clock can be
+        read. Frames where it can't are added to self.unreadable. Returns
+        (frame number, timestamp_s), (None, None) if no clock could be read
+        before end -- seeking may also land past frame_n, or at end itself --
+        or None if the video ends first.
+        '''
+        target = max(0, frame_n - self.seek_late)  # seeking isn't always frame accurate
+        self.stream.set(POS_MSEC, target * self.frame_ms)
+        for retry in range(self.max_retries):
+            success, frame = self.stream.read()
+            if not success:
+                return None
+            self.probes += 1
+            frame_n = int(round(self.stream.get(POS_MSEC) / self.frame_ms))  # of the frame just read
+            if retry == 0:
+                self.seek_late = frame_n - target
+            if frame_n >= end:
+                break
+            try:
+                text, timestamp_s = self.recognizer.read(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY))
+            except (ValueError, IndexError):
+                self.unreadable.add(frame_n)
+                continue
+            return frame_n, timestamp_s
+        return None, None
+
+    def readable_near(self, frame_n, lo, hi):
+        '''the frame strictly between lo and hi closest to frame_n that isn't known to be unreadable'''
+        for dist in xrange(hi - lo):
+            for n in (frame_n + dist, frame_n - dist):
+                if lo < n < hi and n not in self.unreadable:
+                    return n
+        return None
+
+    def bounds(self, timestamp_s):
+        '''
+        (lo, lo_s, hi, hi_s) from the index: frame lo is earlier than
+        timestamp_s, frame hi is not. lo = -1 is before the start, and hi
+        with hi_s None is past the end.
+        '''
+        lo, lo_s = -1, None
+        hi, hi_s = int(self.stream.get(FRAME_COUNT)), None
+        if hi <= 0:  # unknown length; reading past the end narrows it down
+            hi = MAX_FRAMES
+        for pos, pos_s in self.index.items():
+            n = int(round(pos / self.frame_ms))
+            if pos_s < timestamp_s and n > lo:
+                lo, lo_s = n, pos_s
+            elif pos_s >= timestamp_s and n < hi:
+                hi, hi_s = n, pos_s
+        return lo, lo_s, hi, hi_s
+
+    def seek(self, timestamp_s):
+        '''
+        Position (ms) of the first frame with a play time of at least
+        timestamp_s. None if the video ends before it, or if frames with an
+        unreadable clock make it impossible to tell which frame that is.
+        '''
+        lo, lo_s, hi, hi_s = self.bounds(timestamp_s)
+        if lo >= hi and self.index:  # the index has a misread clock in it
+            self.index = {}
+            lo, lo_s, hi, hi_s = self.bounds(timestamp_s)
+        if lo >= hi:
+            return None
+
+        while hi - lo > 1:
+            # the clock runs in real time, so interpolating usually lands
+            # within a second of the answer -- but always cut at least 1/8
+            # off, and bisect once the range is down to about a second
+            guess = (lo + hi) / 2
+            if lo_s is not None and (hi - lo) * self.frame_ms > 1000:
+                guess = lo + int((timestamp_s - lo_s) * 1000. / self.frame_ms)
+            margin = max(1, (hi - lo) / 8)
+            guess = min(max(guess, lo + margin), hi - margin)
+
+            frame_n = self.readable_near(guess, lo, hi)
+            if frame_n is None:
+                break  # every frame left to check has an unreadable clock
+            result = self.probe(frame_n, hi)
+            if result is None:
+                hi, hi_s = frame_n, None  # past the end
+                continue
+            # every pass narrows lo..hi or marks frame_n, so readable_near
+            # can't pick the same frame again
+            n, n_s = result
+            if n is None or n <= lo:
+                self.unreadable.add(frame_n)  # no readable clock, or seeking can't get there
+                continue
+            if (lo_s is not None and n_s < lo_s) or (hi_s is not None and n_s > hi_s):
+                self.unreadable.update((frame_n, n))  # misread clock
+                continue
+            self.index[n * self.frame_ms] = n_s
+            if n_s < timestamp_s:
+                lo, lo_s = n, n_s
+            else:
+                hi, hi_s = n, n_s
+
+        self.save_index()
+        if hi - lo > 1 or hi_s is None:
+            return None
+        return hi * self.frame_ms
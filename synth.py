@@ -0,0 +1,325 @@
+#!/usr/bin/env python
+
+import Queue
+import os
+import re
+import sys
+import time
+
+import cv2
+import numpy
+
+import ocr
+import timestamp
+
+DATA_DIR = os.path.abspath(os.path.dirname(__file__))
+
+# game colors (before translation by OCREngine)
+BOX_BORDER = 97
+BOX_INTERIOR = 246
+TEXT = 97
+TEXT_SHADOW = 206
+
+
+class SyntheticStream(object):
+    '''
+    Render frames laid out like the stream, with a known play time and known
+    text in the dialog box, for testing the pipeline without Twitch.
+
+    script is a list of (kind, text): 'dialog' text is typed out one character
+    per changed frame, 'menu' text is shown all at once. Lines are wrapped to
+    fit the box and split into pages of two lines. change_rate is the chance
+    that the game screen changes on each frame, and noise the standard
+    deviation of gaussian noise added to every frame.
+
+    Frames are laid out at LAYOUT_SIZE, the size ocr.extract_screen expects,
+    and then resized to size. SyntheticStreamProcessor scales them back, so
+    other sizes cost decoding-like resizing work without breaking the
+    pipeline. Files for ocr.py -f must use LAYOUT_SIZE.
+
+    Ground truth is collected in self.truth as frames are rendered: each closed
+    box appends {'frame_n', 'timestamp_s', 'text'}, with the text BoxReader
+    should produce for it.
+    '''
+
+    SCREEN_X, SCREEN_Y, SCALE = 8, 8, 4  # see ocr.extract_screen
+    LAYOUT_SIZE = (1280, 720)
+    TEXT_X, TEXT_Y, LINE_HEIGHT, TEXT_WIDTH = 16, 121, 16, 208
+
+    default_script = [
+        ('dialog', "Hello there! Welcome to the world of POKeMON! My name is BIRCH."),
+        ('menu', 'FIGHT BAG\nPOKEMON RUN'),
+        ('dialog', 'Wild ZIGZAGOON appeared!'),
+        ('dialog', "There's nothing here."),
+        # the second line runs past x=216, close to the right edge of the box
+        ('dialog', 'ZIGZAGOON grew to LV. 12!\nZIGZAGOON learned HEADBUTT and TACKLE!'),
+    ]
+
+    def __init__(self, script=None, fps=60, size=LAYOUT_SIZE, noise=0., change_rate=.5,
+                 start_s=0, hold_s=1., gap_s=1., seed=0):
+        if not 0 < change_rate <= 1:
+            raise ValueError('change_rate must be in (0, 1]')
+        self.script = script or self.default_script
+        self.fps = fps
+        self.size = size
+        self.change_rate = change_rate
+        self.start_s = start_s
+        self.hold_frames = int(hold_s * fps)
+        self.gap_frames = int(gap_s * fps)
+        self.random = numpy.random.RandomState(seed)
+        self.truth = []
+        self.frame_n = 0
+
+        self.glyphs = self.make_glyphs('emerald_tiles.png', 'emerald_tiles.txt')
+        self.background = self.make_background('red_tiles_outside.png')
+        self.ts_patterns = {char: col for col, char in timestamp.TimestampRecognizer.col_to_char.items()}
+
+        # a few precomputed noise planes are enough, and much cheaper than
+        # generating new noise for each frame
+        self.noise = []
+        if noise:
+            w, h = self.LAYOUT_SIZE
+            for _ in range(4):
+                plane = self.random.normal(0, noise, (h, w)).round().astype(numpy.int16)
+                self.noise.append(plane)
+
+        for kind, text in self.script:
+            for line in text.split('\n'):
+                self.text_width(line)  # raises ValueError for unknown characters
+
+        w, h = self.LAYOUT_SIZE
+        self.frame = numpy.zeros((h, w), numpy.uint8)
+        self.last_timestamp = None
+
+    def make_glyphs(self, sheet, text):
+        '''char -> array of its sprite (14 rows, trimmed to its columns) in game colors'''
+        tiles = cv2.cvtColor(cv2.imread(DATA_DIR + '/' + sheet), cv2.COLOR_BGR2GRAY)
+        glyphs = {}
+        # sorted, so characters that appear twice (like E and e-acute) get their first tile
+        for tile_n, char in sorted(ocr.SpriteIdentifier.make_tile_text(DATA_DIR + '/' + text).items()):
+            y, x = divmod(tile_n, len(tiles[0]) / 8)
+            cell = tiles[y*16:y*16+14, x*8:x*8+8]
+            background = cell[0, 0]
+            cols = numpy.nonzero((cell != background).any(axis=0))[0]
+            if not len(cols) or char in glyphs:
+                continue
+            cell = cell[:, cols[0]:cols[-1]+1]
+            colors = sorted(set(cell.flatten()) - {background})
+            glyph = numpy.empty_like(cell)
+            glyph[cell == background] = BOX_INTERIOR
+            glyph[cell == colors[0]] = TEXT
+            glyph[cell == colors[-1]] = TEXT_SHADOW
+            glyphs[char] = glyph
+        return glyphs
+
+    def make_background(self, sheet):
+        tiles = cv2.cvtColor(cv2.imread(DATA_DIR + '/' + sheet), cv2.COLOR_BGR2GRAY)
+        return numpy.tile(tiles, (3, 4))
+
+    def advance(self, char):
+        if char == ' ':
+            return 6  # OCREngine needs a gap of more than 3 to see a space
+        # OCREngine skips at least 3 columns after each character
+        return max(3, self.glyphs[char].shape[1]) + 1
+
+    def text_width(self, text):
+        width = 0
+        for char in text:
+            if char != ' ' and char not in self.glyphs:
+                raise ValueError('no glyph for %r' % char)
+            width += self.advance(char)
+        return width
+
+    def paginate(self, text):
+        lines = []
+        for paragraph in text.split('\n'):
+            line = ''
+            for word in paragraph.split():
+                if line and self.text_width(line + ' ' + word) > self.TEXT_WIDTH:
+                    lines.append(line)
+                    line = word
+                else:
+                    line = (line + ' ' + word).strip()
+            lines.append(line)
+        return [lines[n:n+2] for n in range(0, len(lines), 2)]
+
+    def render_screen(self, box_lines, scroll):
+        '''render the 240x160 game screen, with a dialog box if box_lines is not None'''
+        screen = self.background[scroll % 128:scroll % 128 + 160, :240].copy()
+        if box_lines is None:
+            return screen
+        screen[112:160, :] = BOX_BORDER
+        screen[116:156, 7:233] = BOX_INTERIOR
+        for n, line in enumerate(box_lines):
+            x, y = self.TEXT_X, self.TEXT_Y + n * self.LINE_HEIGHT
+            for char in line:
+                if char != ' ':
+                    glyph = self.glyphs[char]
+                    screen[y:y+14, x:x+glyph.shape[1]] = glyph
+                x += self.advance(char)
+        return screen
+
+    def render_timestamp(self, timestamp_s):
+        minutes, seconds = divmod(timestamp_s, 60)
+        hours, minutes = divmod(minutes, 60)
+        days, hours = divmod(hours, 24)
+        text = '%dd%dh%dm%ds' % (days, hours, minutes, seconds)
+        if text == self.last_timestamp:
+            return
+        self.last_timestamp = text
+        # TimestampRecognizer reads characters from the number of bright
+        # pixels in each column, separated by dark columns
+        region = self.frame[48:80, 970:1117]
+        region[:] = 0
+        x = 0
+        for char in text:
+            for col in self.ts_patterns[char]:
+                height = 2 * (ord(col) - ord('A'))
+                region[16 - height / 2:16 - height / 2 + height, x] = 255
+                x += 1
+            x += 2
+
+    def render(self, box_lines, scroll):
+        screen = self.render_screen(box_lines, scroll)
+        s = self.SCALE
+        self.frame[self.SCREEN_Y:self.SCREEN_Y+160*s, self.SCREEN_X:self.SCREEN_X+240*s] = \
+            cv2.resize(screen, (240 * s, 160 * s), interpolation=cv2.INTER_NEAREST)
+        self.render_timestamp(self.timestamp_s())
+        frame = self.frame
+        if self.noise:
+            noise = self.noise[self.frame_n % len(self.noise)]
+            frame = numpy.clip(frame + noise, 0, 255).astype(numpy.uint8)
+        if self.size != self.LAYOUT_SIZE:
+            frame = cv2.resize(frame, self.size, interpolation=cv2.INTER_AREA)
+        self.frame_n += 1
+        return cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR)
+
+    def timestamp_s(self):
+        return self.start_s + self.frame_n / self.fps
+
+    def changes(self):
+        return self.random.random_sample() < self.change_rate
+
+    def frames(self):
+        '''yield BGR frames forever, like a video capture would'''
+        scroll = 0
+        while True:
+            for kind, text in self.script:
+                shown = []
+                for page in self.paginate(text):
+                    if kind == 'dialog':
+                        typed = 1  # an empty box would look like it closed
+                        while typed < len('\n'.join(page)):
+                            if self.changes():
+                                typed += 1
+                            yield self.render('\n'.join(page)[:typed].split('\n'), scroll)
+                    for _ in xrange(self.hold_frames):
+                        yield self.render(page, scroll)
+                    shown += page
+                self.add_truth(shown)
+                for _ in xrange(self.gap_frames):
+                    if self.changes():
+                        scroll += 1
+                    yield self.render(None, scroll)
+
+    def add_truth(self, lines):
+        lines = [line for line in lines if 'FIGHT BAG' not in line and 'POKEMON RUN' not in line]
+        text = re.sub(r'- ', '', re.sub(r'\s+', ' ', ' '.join(lines).strip()))
+        if text:
+            self.truth.append({'frame_n': self.frame_n, 'timestamp_s': self.timestamp_s(), 'text': text})
+
+    def write(self, fname, seconds):
+        '''write the given number of seconds of frames to a video file'''
+        fourcc = getattr(cv2, 'VideoWriter_fourcc', None) or cv2.cv.CV_FOURCC  # OpenCV 3+ / 2.x
+        writer = cv2.VideoWriter(fname, fourcc(*'MJPG'), self.fps, self.size)
+        for n, frame in enumerate(self.frames()):
+            if n >= seconds * self.fps:
+                break
+            writer.write(frame)
+        writer.release()
+
+
+class SyntheticStreamProcessor(ocr.StreamProcessor):
+    '''
+    StreamProcessor fed directly by a SyntheticStream, paced at the stream's
+    fps (or as fast as possible if realtime is False). Frames that don't fit
+    in the queue are dropped, like the live stream.
+    '''
+    def __init__(self, stream, realtime=True, max_frames=None, **kwargs):
+        kwargs.setdefault('ratelimit', False)
+        ocr.StreamProcessor.__init__(self, **kwargs)
+        self.stream = stream
+        self.realtime = realtime
+        self.max_frames = max_frames
+        self.grabbed = 0
+        self.dropped = 0
+
+    def grab_frames(self):
+        start = time.time()
+        for n, frame in enumerate(self.stream.frames()):
+            if self.max_frames is not None and n >= self.max_frames:
+                break
+            if self.realtime:
+                time.sleep(max(0, start + float(n) / self.stream.fps - time.time()))
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            if self.stream.size != self.stream.LAYOUT_SIZE:
+                frame = cv2.resize(frame, self.stream.LAYOUT_SIZE, interpolation=cv2.INTER_NEAREST)
+            try:
+                self.frame_queue.put((time.time(), frame), block=False)
+                self.grabbed += 1
+            except Queue.Full:
+                self.dropped += 1
+        self.frame_queue.put(None)
+
+
+if __name__ == '__main__':
+    import dialog
+
+    def arg(name, default):
+        try:
+            return type(default)(sys.argv[sys.argv.index(name) + 1])
+        except (ValueError, IndexError):
+            return default
+
+    fps = arg('--fps', 60)
+    size = tuple(map(int, arg('--size', '%dx%d' % SyntheticStream.LAYOUT_SIZE).split('x')))
+    stream = SyntheticStream(fps=fps, size=size, noise=arg('--noise', 0.), change_rate=arg('--change-rate', .5))
+
+    if '-o' in sys.argv:
+        # write a file to use with ocr.py -f (which needs the default --size)
+        stream.write(arg('-o', 'synthetic.avi'), arg('--seconds', 60))
+        sys.exit(0)
+
+    dialogs = []
+    box_reader = dialog.BoxReader(incremental='--incremental' in sys.argv)
+    box_reader.add_dialog_handler(lambda text, data: dialogs.append(text))
+    proc = SyntheticStreamProcessor(stream, realtime='--fast' not in sys.argv,
+                                    max_frames=arg('--seconds', 60) * fps,
+                                    cache_size=arg('--cache', 0))
+    proc.add_handler(box_reader.handle)
+
+    start = time.time()
+    proc.run()
+    elapsed = time.time() - start
+    print '%d frames in %.1fs (%.1f fps), %d dropped' % (
+        proc.grabbed, elapsed, proc.grabbed / elapsed, proc.dropped)
+    ocr_engine = proc.sprite_identifier.ocr_engine
+    if ocr_engine.cache_size:
+        stats = ocr_engine.cache_stats()
+        print 'OCR cache: %d hits, %d misses (%.1f%% hit rate)' % (
+            stats['hits'], stats['misses'], stats['hit_rate'] * 100)
+    unread = [t['text'] for t in stream.truth]
+    misread = []
+    for text in dialogs:
+        if text in unread:
+            unread.remove(text)  # each truth entry is only read once
+        else:
+            misread.append(text)
+    print '%d/%d dialogs read correctly' % (len(stream.truth) - len(unread), len(stream.truth))
+    for text in misread:
+        print 'misread:', text
+    if box_reader.incremental:
+        stats = box_reader.latency_stats()
+        if stats['count']:
+            print ('%(count)d lines published, latency mean %(mean).2fs, median %(median).2fs, '
+                   'max %(max).2fs, %(over_bound)d over %(max_latency).1fs') % dict(stats, max_latency=box_reader.max_latency)
@@ -30,22 +30,28 @@ class TimestampRecognizer(object):
         self.timestamp_s = 0
 
     def handle(self, data):
-        x1, x2, y1, y2 = 970, 970+147, 48, 48 + 32
-        timestamp = data['frame'][y1:y2, x1:x2]
-        col_sum = (timestamp > 150).sum(axis=0)  # Sum bright pixels in each column
-        col_str = (col_sum *.5 + ord('A')).astype(numpy.int8).tostring()  #
-        strings = re.split(r'A*', col_str)  # Segment by black columns
         try:
-            result = self.convert(strings)
-            days, hours, minutes, seconds = map(int, re.split('[dhms]', result)[:-1])
-            self.timestamp = result
-            self.timestamp_s = ((days * 24 + hours) * 60 + minutes) * 60 + seconds
+            self.timestamp, self.timestamp_s = self.read(data['frame'])
         except (ValueError, IndexError):
             pass    # invalid timestamp (ocr failed)
         finally:
             data['timestamp'] = self.timestamp
             data['timestamp_s'] = self.timestamp_s
 
+    def read(self, frame):
+        '''
+        Read the play time from a frame, as ('1d2h3m4s', seconds).
+        Raises ValueError or IndexError if it can't be read.
+        '''
+        x1, x2, y1, y2 = 970, 970+147, 48, 48 + 32
+        timestamp = frame[y1:y2, x1:x2]
+        col_sum = (timestamp > 150).sum(axis=0)  # Sum bright pixels in each column
+        col_str = (col_sum *.5 + ord('A')).astype(numpy.int8).tostring()  #
+        strings = re.split(r'A*', col_str)  # Segment by black columns
+        result = self.convert(strings)
+        days, hours, minutes, seconds = map(int, re.split('[dhms]', result)[:-1])
+        return result, ((days * 24 + hours) * 60 + minutes) * 60 + seconds
+
     def convert(self, strings):
         col_to_char = self.col_to_char
 
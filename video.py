@@ -1,7 +1,9 @@
+import collections
 import gzip
 import os
 import struct
 import time
+import zlib
 
 import cv2
 import numpy
@@ -36,7 +38,10 @@ class ScreenExtractor(object):
 
 
 class OCREngine(object):
-    def __init__(self, sprites, sprite_text):
+    # top row of the first line of text in a dialog box
+    DIALOG_TEXT_Y = 121
+
+    def __init__(self, sprites, sprite_text, cache_size=0, full_screen=False):
         def pack_image(buf):
             out = []
             for n in range(0, len(buf) / 14):
@@ -77,6 +82,71 @@ class OCREngine(object):
         self.last_image = None
         self.last_matched = None
 
+        # Unless full_screen is set, only look for text when a dialog box
+        # is open, and only inside it.
+        self.full_screen = full_screen
+
+        # The game keeps returning to the same screens (battle menus, the
+        # start menu, signposts), so keep the raw matches of recently seen
+        # screens, keyed on a checksum of the scanned part of the
+        # translated image. Off by default: changed frames rarely repeat
+        # exactly, and the box-only scan is already about as cheap as a
+        # lookup, so it mostly pays off with full_screen.
+        self.cache = collections.OrderedDict()
+        self.cache_size = cache_size
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def cache_stats(self):
+        lookups = self.cache_hits + self.cache_misses
+        return {'hits': self.cache_hits, 'misses': self.cache_misses,
+                'size': len(self.cache),
+                'hit_rate': float(self.cache_hits) / lookups if lookups else 0.}
+
+    def find_dialog_box(self, image):
+        ''' cheap check for an open dialog box on a translated image:
+        the padding above and beside the text is a single color, and
+        there's something else inside
+        '''
+        grid = image.reshape(240, 160)  # column-major: grid[x, y]
+        top = self.DIALOG_TEXT_Y
+        background = grid[8, top - 1]
+        if (grid[16:224, top-2:top] != background).any():
+            return False
+        # box interiors span x=8..231 (x=7..232 in some boxes), and lines
+        # of a full width message window run up to x=223
+        if (grid[8:16, top-1:top+31] != background).any():
+            return False
+        if (grid[224:232, top-1:top+31] != background).any():
+            return False
+        return (grid[16:224, top:top+31] != background).any()
+
+    def match_sprites(self, image, pimage, max_matches, y_start=1):
+        ''' run identify_sprites on a translated image, from row y_start
+        down, reusing the matches of a recently seen identical image if
+        possible
+        '''
+        if not self.cache_size:
+            results = ffi.new('struct sprite_match[]', max_matches)
+            matched = C.identify_sprites_rows(pimage, y_start, 160, self.sprites, self.n_sprites, results, max_matches)
+            return results, matched
+
+        # only the scanned rows (and the row above them) affect the matches
+        scanned = numpy.ascontiguousarray(image.reshape(240, 160)[:, y_start-1:])
+        key = (y_start, zlib.adler32(scanned))
+        cached = self.cache.pop(key, None)
+        if cached is not None and numpy.array_equal(cached[0], scanned):
+            self.cache_hits += 1
+        else:
+            self.cache_misses += 1
+            results = ffi.new('struct sprite_match[]', max_matches)
+            matched = C.identify_sprites_rows(pimage, y_start, 160, self.sprites, self.n_sprites, results, max_matches)
+            cached = (scanned, results, matched)
+            if len(self.cache) >= self.cache_size:
+                self.cache.popitem(last=False)
+        self.cache[key] = cached  # most recently used goes last
+        return cached[1:]
+
     def identify(self, screen):
         ''' recognize text on screen, return list of lists of
         [ypos, xbegin, xend, text]
@@ -88,8 +158,19 @@ class OCREngine(object):
         if numpy.array_equal(image, self.last_image):
             return self.last_out
         self.last_image = image
-        results = ffi.new('struct sprite_match[]', max_matches)
-        matched = C.identify_sprites(pimage, self.sprites, self.n_sprites, results, max_matches)
+        if self.full_screen:
+            y_start = 1
+        elif self.find_dialog_box(image):
+            y_start = self.DIALOG_TEXT_Y
+        else:
+            # nothing to merge with the next frame, like an empty scan
+            self.last_matched = None
+            self.last_out = []
+            return self.last_out
+        # cached matches are never written to (merge_sprites only writes
+        # to its dest), so the temporal merge below sees the same input it
+        # would have gotten from a fresh scan.
+        results, matched = self.match_sprites(image, pimage, max_matches, y_start)
         if self.last_matched is not None:
             overlap = ffi.new('int *')
             merged = ffi.new('struct sprite_match[]', max_matches)
@@ -113,6 +194,34 @@ class OCREngine(object):
         self.last_out = out
         return out
 
+    def benchmark(self, screens, repeat=100):
+        ''' time identify_sprites against identify_sprites_reference on
+        the given screens, checking that both find the same matches
+        '''
+        max_matches = 128
+        images = []
+        for screen in screens:
+            image = screen.flatten(order='F')
+            C.translate_bytes(ffi.cast('uint8_t *', image.ctypes.data), 240*160, self.map)
+            images.append(image)
+
+        found = {}
+        for name in ('identify_sprites_reference', 'identify_sprites'):
+            func = getattr(C, name)
+            results = ffi.new('struct sprite_match[]', max_matches)
+            start = time.time()
+            for _ in xrange(repeat):
+                for image in images:
+                    func(ffi.cast('uint8_t *', image.ctypes.data), self.sprites, self.n_sprites, results, max_matches)
+            elapsed = time.time() - start
+            matches = []
+            for image in images:
+                matched = func(ffi.cast('uint8_t *', image.ctypes.data), self.sprites, self.n_sprites, results, max_matches)
+                matches.append([(m.x, m.y, m.sp.id, m.space) for m in results[0:matched]])
+            found[name] = matches
+            print '%s: %.3f ms/screen' % (name, elapsed * 1000 / (repeat * len(images)))
+        assert found['identify_sprites'] == found['identify_sprites_reference']
+
 
 class ScreenCompressor(object):
     '''